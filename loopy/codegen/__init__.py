@@ -20,11 +20,15 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import os
 import sys
+import weakref
+from collections import OrderedDict
 from immutables import Map
 from typing import (Set, Mapping, Sequence, Any, FrozenSet, Union,
        Optional, Tuple, TYPE_CHECKING)
 from dataclasses import dataclass, replace
+from functools import cached_property
 import logging
 
 from loopy.codegen.result import CodeGenerationResult
@@ -123,6 +127,26 @@ class SeenFunction:
     result_dtypes: Tuple[LoopyType, ...]
 
 
+def _spaces_match_by_name(space_a: isl.Space, space_b: isl.Space) -> bool:
+    # isl.Space.is_equal does not take the names of the dimensions into
+    # account, :func:`islpy.align_two` does.
+    return (space_a.is_equal(space_b)
+            and all(space_a.get_dim_name(dt, i) == space_b.get_dim_name(dt, i)
+                    for dt in [isl.dim_type.param, isl.dim_type.set]
+                    for i in range(space_a.dim(dt))))
+
+
+def _add_iname_to_domain(domain, iname):
+    space = domain.get_space()
+    if (space.find_dim_by_name(isl.dim_type.set, iname) != -1
+            or space.find_dim_by_name(isl.dim_type.param, iname) != -1):
+        return domain
+
+    return (domain
+            .add_dims(isl.dim_type.set, 1)
+            .set_dim_name(isl.dim_type.set, domain.dim(isl.dim_type.set), iname))
+
+
 @dataclass(frozen=True)
 class CodeGenerationState:
     """
@@ -213,7 +237,15 @@ class CodeGenerationState:
     # {{{ copy helpers
 
     def copy(self, **kwargs: Any) -> "CodeGenerationState":
-        return replace(self, **kwargs)
+        new_state = replace(self, **kwargs)
+
+        # The AST builder only depends on the target and on whether device
+        # code is being generated, so carry it over if neither changed.
+        if ("ast_builder" in self.__dict__
+                and not (_AST_BUILDER_DEPENDENCIES & kwargs.keys())):
+            new_state.__dict__["ast_builder"] = self.__dict__["ast_builder"]
+
+        return new_state
 
     def copy_and_assign(
             self, name: str, value: ExpressionT) -> "CodeGenerationState":
@@ -222,31 +254,28 @@ class CodeGenerationState:
 
     def copy_and_assign_many(self, assignments) -> "CodeGenerationState":
         """Make a copy of self with *assignments* included."""
+        if not assignments:
+            return self
 
         return self.copy(var_subst_map=self.var_subst_map.update(assignments))
 
     # }}}
 
-    @property
+    @cached_property
     def expression_to_code_mapper(self):
         return self.ast_builder.get_expression_to_code_mapper(self)
 
     def intersect(self, other):
+        if _spaces_match_by_name(
+                self.implemented_domain.get_space(), other.get_space()):
+            return self.copy(implemented_domain=self.implemented_domain & other)
+
         new_impl, new_other = isl.align_two(self.implemented_domain, other)
         return self.copy(implemented_domain=new_impl & new_other)
 
     def fix(self, iname, aff):
-        new_impl_domain = self.implemented_domain
-
-        impl_space = self.implemented_domain.get_space()
-        if iname not in impl_space.get_var_dict():
-            new_impl_domain = (new_impl_domain
-                    .add_dims(isl.dim_type.set, 1)
-                    .set_dim_name(
-                        isl.dim_type.set,
-                        new_impl_domain.dim(isl.dim_type.set),
-                        iname))
-            impl_space = new_impl_domain.get_space()
+        new_impl_domain = _add_iname_to_domain(self.implemented_domain, iname)
+        impl_space = new_impl_domain.get_space()
 
         from loopy.isl_helpers import iname_rel_aff
         iname_plus_lb_aff = iname_rel_aff(impl_space, iname, "==", aff)
@@ -256,7 +285,8 @@ class CodeGenerationState:
         expr = pw_aff_to_expr(aff)
 
         new_impl_domain = new_impl_domain.add_constraint(cns)
-        return self.copy_and_assign(iname, expr).copy(
+        return self.copy(
+                var_subst_map=self.var_subst_map.set(iname, expr),
                 implemented_domain=new_impl_domain)
 
     def try_vectorized(self, what, func):
@@ -276,22 +306,31 @@ class CodeGenerationState:
         try:
             return func(self)
         except UnvectorizableError as e:
-            warn(self.kernel, "vectorize_failed",
-                    "Vectorization of '%s' failed because '%s'"
-                    % (what, e))
+            return self._unvectorize_after_failure(what, e, func)
+
+    def _unvectorize_after_failure(self, what, error, func):
+        warn(self.kernel, "vectorize_failed",
+                "Vectorization of '%s' failed because '%s'"
+                % (what, error))
 
-            return self.unvectorize(func)
+        return self.unvectorize(func)
 
     def unvectorize(self, func):
         vinf = self.vectorization_info
         assert vinf is not None
 
         result = []
-        novec_self = self.copy(vectorization_info=None)
+        # Add the vector iname to the implemented domain once, rather than
+        # once per lane in fix().
+        novec_self = self.copy(
+                vectorization_info=None,
+                implemented_domain=_add_iname_to_domain(
+                    self.implemented_domain, vinf.iname))
+
+        zero_aff = isl.Aff.zero_on_domain(vinf.space.params())
 
         for i in range(vinf.length):
-            idx_aff = isl.Aff.zero_on_domain(vinf.space.params()) + i
-            new_codegen_state = novec_self.fix(vinf.iname, idx_aff)
+            new_codegen_state = novec_self.fix(vinf.iname, zero_aff + i)
             generated = func(new_codegen_state)
 
             if isinstance(generated, list):
@@ -302,13 +341,17 @@ class CodeGenerationState:
         from loopy.codegen.result import merge_codegen_results
         return merge_codegen_results(self, result)
 
-    @property
+    @cached_property
     def ast_builder(self):
         if self.is_generating_device_code:
             return self.kernel.target.get_device_ast_builder()
         else:
             return self.kernel.target.get_host_ast_builder()
 
+
+_AST_BUILDER_DEPENDENCIES = frozenset({
+    "kernel", "target", "is_generating_device_code"})
+
 # }}}
 
 
@@ -352,6 +395,29 @@ class InKernelCallablesCollector(CombineMapper):
 
 @dataclass(frozen=True)
 class PreambleInfo:
+    """
+    .. attribute:: kernel
+    .. attribute:: seen_dtypes
+
+        A :class:`set` of the :class:`~loopy.types.LoopyType` instances
+        encountered during code generation.
+
+    .. attribute:: seen_functions
+
+        A :class:`set` of :class:`SeenFunction` instances.
+
+    .. attribute:: seen_atomic_dtypes
+
+        A :class:`set` of the :class:`~loopy.types.LoopyType` instances
+        for which atomic operations were emitted.
+
+    .. attribute:: codegen_state
+
+    .. note::
+
+        The code generator and targets accumulate into the ``seen_*`` sets
+        via :meth:`set.add` while code is being generated.
+    """
     kernel: LoopKernel
     seen_dtypes: Set[LoopyType]
     seen_functions: Set[SeenFunction]
@@ -364,11 +430,14 @@ class PreambleInfo:
 # {{{ main code generation entrypoint
 
 def generate_code_for_a_single_kernel(kernel, callables_table, target,
-        is_entrypoint):
+        is_entrypoint, codegen_cachemanager=None):
     """
     :returns: a :class:`CodeGenerationResult`
 
     :param kernel: An instance of :class:`loopy.LoopKernel`.
+    :param codegen_cachemanager: An optional instance of
+        :class:`loopy.codegen.tools.CodegenOperationCacheManager` to reuse.
+        If not valid for *kernel*, a new one is created.
     """
 
     from loopy.kernel import KernelState
@@ -378,15 +447,6 @@ def generate_code_for_a_single_kernel(kernel, callables_table, target,
 
     codegen_plog = ProcessLogger(logger, f"{kernel.name}: generate code")
 
-    # {{{ examine arg list
-
-    allow_complex = False
-    for var in kernel.args + list(kernel.temporary_variables.values()):
-        if var.dtype.involves_complex():
-            allow_complex = True
-
-    # }}}
-
     seen_dtypes = set()
     seen_functions = set()
     seen_atomic_dtypes = set()
@@ -395,6 +455,11 @@ def generate_code_for_a_single_kernel(kernel, callables_table, target,
 
     from loopy.codegen.tools import CodegenOperationCacheManager
 
+    if codegen_cachemanager is None:
+        codegen_cachemanager = CodegenOperationCacheManager.from_kernel(kernel)
+    else:
+        codegen_cachemanager = codegen_cachemanager.with_kernel(kernel)
+
     codegen_state = CodeGenerationState(
             kernel=kernel,
             target=target,
@@ -404,7 +469,7 @@ def generate_code_for_a_single_kernel(kernel, callables_table, target,
             seen_functions=seen_functions,
             seen_atomic_dtypes=seen_atomic_dtypes,
             var_subst_map=Map(),
-            allow_complex=allow_complex,
+            allow_complex=kernel.has_complex_dtypes,
             var_name_generator=kernel.get_var_name_generator(),
             is_generating_device_code=False,
             gen_program_name=(
@@ -414,7 +479,7 @@ def generate_code_for_a_single_kernel(kernel, callables_table, target,
             schedule_index_end=len(kernel.linearization),
             callables_table=callables_table,
             is_entrypoint=is_entrypoint,
-            codegen_cachemanager=CodegenOperationCacheManager.from_kernel(kernel),
+            codegen_cachemanager=codegen_cachemanager,
             )
 
     from loopy.codegen.result import generate_host_or_device_program
@@ -431,16 +496,13 @@ def generate_code_for_a_single_kernel(kernel, callables_table, target,
 
     # {{{ handle preambles
 
-    for arg in kernel.args:
-        seen_dtypes.add(arg.dtype)
-
-    for tv in kernel.temporary_variables.values():
-        seen_dtypes.add(tv.dtype)
+    seen_dtypes.update(arg.dtype for arg in kernel.args)
+    seen_dtypes.update(tv.dtype for tv in kernel.temporary_variables.values())
 
     if kernel.all_inames():
         seen_dtypes.add(kernel.index_dtype)
 
-    preambles = kernel.preambles + codegen_result.device_preambles
+    preambles = [*kernel.preambles, *codegen_result.device_preambles]
 
     preamble_info = PreambleInfo(
             kernel=kernel,
@@ -451,20 +513,27 @@ def generate_code_for_a_single_kernel(kernel, callables_table, target,
             codegen_state=codegen_state
             )
 
-    preamble_generators = (list(kernel.preamble_generators)
-            + list(target.get_device_ast_builder().preamble_generators()))
-    for prea_gen in preamble_generators:
-        preambles = preambles + tuple(prea_gen(preamble_info))
+    device_ast_builder = target.get_device_ast_builder()
+    for prea_gen in [*kernel.preamble_generators,
+                     *device_ast_builder.preamble_generators()]:
+        preambles.extend(prea_gen(preamble_info))
+
+    # Neither the codegen state nor anything cached on it is needed below.
+    del preamble_info
+    del codegen_state
 
-    codegen_result = codegen_result.copy(device_preambles=preambles)
+    codegen_result = codegen_result.copy(device_preambles=tuple(preambles))
 
     # }}}
 
     # For faster unpickling in the common case when implemented_domains isn't needed.
-    from loopy.tools import LazilyUnpicklingDict
-    codegen_result = codegen_result.copy(
-            implemented_domains=LazilyUnpicklingDict(
-                    codegen_result.implemented_domains))
+    # Only worth it if the result may end up in a persistent cache.
+    from loopy import CACHING_ENABLED
+    if CACHING_ENABLED:
+        from loopy.tools import LazilyUnpicklingDict
+        codegen_result = codegen_result.copy(
+                implemented_domains=LazilyUnpicklingDict(
+                        codegen_result.implemented_domains))
 
     codegen_plog.done()
 
@@ -482,7 +551,6 @@ def diverge_callee_entrypoints(program):
     callable_ids = get_reachable_resolved_callable_ids(program.callables_table,
                                                        program.entrypoints)
 
-    new_callables = {}
     todo_renames = {}
 
     vng = make_callable_name_generator(program.callables_table)
@@ -490,19 +558,32 @@ def diverge_callee_entrypoints(program):
     for clbl_id in callable_ids & program.entrypoints:
         todo_renames[clbl_id] = vng(based_on=clbl_id)
 
-    for name, clbl in program.callables_table.items():
-        if name in todo_renames:
-            name = todo_renames[name]
+    if not todo_renames:
+        return program
 
-        if isinstance(clbl, CallableKernel):
-            knl = rename_resolved_functions_in_a_single_kernel(clbl.subkernel,
-                                                               todo_renames)
-            knl = knl.copy(name=name)
-            clbl = clbl.copy(subkernel=knl)
+    with program.callables_table.mutate() as new_callables:
+        for name, clbl in program.callables_table.items():
+            new_name = todo_renames.get(name, name)
 
-        new_callables[name] = clbl
+            if isinstance(clbl, CallableKernel):
+                knl = clbl.subkernel
+                if not todo_renames.keys().isdisjoint(
+                        clbl.get_called_callables(program.callables_table,
+                                                  recursive=False)):
+                    knl = rename_resolved_functions_in_a_single_kernel(
+                            knl, todo_renames)
+                if new_name != name:
+                    knl = knl.copy(name=new_name)
+                if knl is not clbl.subkernel:
+                    clbl = clbl.copy(subkernel=knl)
 
-    return program.copy(callables_table=Map(new_callables))
+            if new_name != name:
+                del new_callables[name]
+                new_callables[new_name] = clbl
+            elif clbl is not program.callables_table[name]:
+                new_callables[name] = clbl
+
+        return program.copy(callables_table=new_callables.finish())
 
 
 @dataclass(frozen=True)
@@ -535,20 +616,19 @@ class TranslationUnitCodeGenerationResult:
         from loopy.codegen.result import process_preambles
         preamble_codes = process_preambles(getattr(self, "host_preambles", []))
 
-        return (
-                "".join(preamble_codes)
-                + "\n"
-                + "\n\n".join(str(hp.ast)
-                              for hp in self.host_programs.values()))
+        return "".join([
+                *preamble_codes,
+                "\n",
+                "\n\n".join(str(hp.ast) for hp in self.host_programs.values())])
 
     def device_code(self):
         from loopy.codegen.result import process_preambles
         preamble_codes = process_preambles(getattr(self, "device_preambles", []))
 
-        return (
-                "".join(preamble_codes)
-                + "\n"
-                + "\n\n".join(str(dp.ast) for dp in self.device_programs))
+        return "".join([
+                *preamble_codes,
+                "\n",
+                "\n\n".join(str(dp.ast) for dp in self.device_programs)])
 
     def all_code(self):
         from loopy.codegen.result import process_preambles
@@ -558,13 +638,97 @@ class TranslationUnitCodeGenerationResult:
                 tuple(getattr(self, "device_preambles", ()))
                 )
 
-        return (
-                "".join(preamble_codes)
-                + "\n"
-                + "\n\n".join(str(dp.ast) for dp in self.device_programs)
-                + "\n\n"
-                + "\n\n".join(str(hp.ast) for hp in
-                    self.host_programs.values()))
+        return "".join([
+                *preamble_codes,
+                "\n",
+                "\n\n".join(str(dp.ast) for dp in self.device_programs),
+                "\n\n",
+                "\n\n".join(str(hp.ast) for hp in self.host_programs.values())])
+
+
+# Maps ``id(t_unit)`` to a weak reference to *t_unit* and its code generation
+# result. Entries go away with their translation unit, and the table is
+# bounded so that it never keeps more than a few results alive.
+_CODE_GEN_RESULTS: "OrderedDict[int, Tuple[weakref.ref, Any]]" = OrderedDict()
+_MAX_CODE_GEN_RESULTS = 16
+
+
+def _get_remembered_code_gen_result(t_unit):
+    try:
+        t_unit_ref, cgr = _CODE_GEN_RESULTS[id(t_unit)]
+    except KeyError:
+        return None
+
+    if t_unit_ref() is not t_unit:
+        return None
+
+    _CODE_GEN_RESULTS.move_to_end(id(t_unit))
+    return cgr
+
+
+def _remember_code_gen_result(t_unit, cgr):
+    if not isinstance(t_unit, TranslationUnit):
+        return
+
+    key = id(t_unit)
+
+    def forget(t_unit_ref):
+        entry = _CODE_GEN_RESULTS.get(key)
+        if entry is not None and entry[0] is t_unit_ref:
+            del _CODE_GEN_RESULTS[key]
+
+    _CODE_GEN_RESULTS[key] = (weakref.ref(t_unit, forget), cgr)
+    _CODE_GEN_RESULTS.move_to_end(key)
+
+    while len(_CODE_GEN_RESULTS) > _MAX_CODE_GEN_RESULTS:
+        _CODE_GEN_RESULTS.popitem(last=False)
+
+
+def _get_shared_codegen_cachemanagers(kernels):
+    """Returns a list of
+    :class:`~loopy.codegen.tools.CodegenOperationCacheManager` instances, one
+    per kernel in *kernels*, in which kernels that share their instructions,
+    linearization and inames (such as callees duplicated by
+    :func:`diverge_callee_entrypoints`) share a cache manager.
+    """
+    from loopy.codegen.tools import CodegenOperationCacheManager
+
+    key_to_cachemanager = {}
+    result = []
+    for knl in kernels:
+        # kernels are kept alive by the caller, so their ids are stable
+        key = (id(knl.instructions), id(knl.linearization), id(knl.inames))
+        try:
+            cachemanager = key_to_cachemanager[key]
+        except KeyError:
+            cachemanager = CodegenOperationCacheManager.from_kernel(knl)
+            key_to_cachemanager[key] = cachemanager
+
+        result.append(cachemanager)
+
+    return result
+
+
+# Starting worker processes costs more than generating code for a handful of
+# kernels serially.
+_MIN_KERNELS_FOR_PARALLEL_CODEGEN = 8
+
+
+def _parse_codegen_jobs(value: str) -> int:
+    try:
+        njobs = int(value)
+    except ValueError:
+        njobs = 0
+
+    if njobs < 1:
+        raise LoopyError("LOOPY_CODEGEN_JOBS must be a positive integer, "
+                f"got '{value}'")
+
+    return njobs
+
+
+def _get_codegen_jobs() -> int:
+    return _parse_codegen_jobs(os.environ.get("LOOPY_CODEGEN_JOBS", "1"))
 
 
 def generate_code_v2(t_unit: TranslationUnit) -> CodeGenerationResult:
@@ -577,10 +741,18 @@ def generate_code_v2(t_unit: TranslationUnit) -> CodeGenerationResult:
 
     if CACHING_ENABLED:
         input_t_unit = t_unit
+
+        # Translation units are immutable, so a result remembered for this
+        # very object lets us skip computing the persistent cache key.
+        result = _get_remembered_code_gen_result(input_t_unit)
+        if result is not None:
+            return result
+
         try:
             result = code_gen_cache[input_t_unit]
             logger.debug(f"TranslationUnit with entrypoints {t_unit.entrypoints}:"
                           " code generation cache hit")
+            _remember_code_gen_result(input_t_unit, result)
             return result
         except KeyError:
             logger.debug(f"TranslationUnit with entrypoints {t_unit.entrypoints}:"
@@ -624,13 +796,45 @@ def generate_code_v2(t_unit: TranslationUnit) -> CodeGenerationResult:
 
     # {{{ collect host/device programs
 
-    for func_id in sorted(key for key, val in t_unit.callables_table.items()
-                          if isinstance(val, CallableKernel)):
-        cgr = generate_code_for_a_single_kernel(t_unit[func_id],
-                                                t_unit.callables_table,
-                                                t_unit.target,
-                                                func_id in t_unit.entrypoints)
-        if func_id in t_unit.entrypoints:
+    kernel_callables = sorted(
+            ((func_id, clbl)
+             for func_id, clbl in t_unit.callables_table.items()
+             if isinstance(clbl, CallableKernel)),
+            key=lambda func_id_and_clbl: func_id_and_clbl[0])
+    kernel_func_ids = [func_id for func_id, _ in kernel_callables]
+    kernels = [clbl.subkernel for _, clbl in kernel_callables]
+
+    entrypoints = t_unit.entrypoints
+    is_entrypoint = [func_id in entrypoints for func_id in kernel_func_ids]
+    codegen_cachemanagers = _get_shared_codegen_cachemanagers(kernels)
+
+    if len(kernels) >= _MIN_KERNELS_FOR_PARALLEL_CODEGEN:
+        ncodegen_jobs = min(_get_codegen_jobs(), len(kernels))
+    else:
+        ncodegen_jobs = 1
+
+    if ncodegen_jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=ncodegen_jobs) as executor:
+            cgrs = list(executor.map(
+                generate_code_for_a_single_kernel,
+                kernels,
+                [t_unit.callables_table] * len(kernels),
+                [t_unit.target] * len(kernels),
+                is_entrypoint,
+                codegen_cachemanagers))
+    else:
+        cgrs = [generate_code_for_a_single_kernel(knl,
+                                                  t_unit.callables_table,
+                                                  t_unit.target,
+                                                  knl_is_entrypoint,
+                                                  cachemanager)
+                for knl, knl_is_entrypoint, cachemanager in zip(
+                    kernels, is_entrypoint, codegen_cachemanagers)]
+
+    for func_id, func_is_entrypoint, cgr in zip(
+            kernel_func_ids, is_entrypoint, cgrs):
+        if func_is_entrypoint:
             host_programs[func_id] = cgr.host_program
         else:
             assert len(cgr.device_programs) == 1
@@ -649,10 +853,9 @@ def generate_code_v2(t_unit: TranslationUnit) -> CodeGenerationResult:
     # }}}
 
     # adding the callee fdecls to the device_programs
-    device_programs = ([device_programs[0].copy(
+    device_programs[0] = device_programs[0].copy(
             ast=t_unit.target.get_device_ast_builder().ast_module.Collection(
-                callee_fdecls+[device_programs[0].ast]))] +
-            device_programs[1:])
+                [*callee_fdecls, device_programs[0].ast]))
     cgr = TranslationUnitCodeGenerationResult(
             host_programs=host_programs,
             device_programs=device_programs,
@@ -660,6 +863,7 @@ def generate_code_v2(t_unit: TranslationUnit) -> CodeGenerationResult:
 
     if CACHING_ENABLED:
         code_gen_cache.store_if_not_present(input_t_unit, cgr)
+        _remember_code_gen_result(input_t_unit, cgr)
 
     return cgr
 
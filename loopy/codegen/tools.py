@@ -106,7 +106,14 @@ class CodegenOperationCacheManager:
         corresponding to *kernel* if the cached variables in *self* would
         be invalid for *kernel*, else returns *self*.
         """
-        if self.kernel_proxy != kernel:
+        proxy = self.kernel_proxy
+        if (proxy.instructions is kernel.instructions
+                and proxy.linearization is kernel.linearization
+                and proxy.inames is kernel.inames):
+            # built from *kernel* (or a kernel sharing its attributes)
+            return self
+
+        if proxy != kernel:
             # cached values are invalidated, must create a new one
             return CodegenOperationCacheManager.from_kernel(kernel)
 
@@ -772,6 +772,16 @@ class LoopKernel(Taggable):
     def arg_dict(self) -> Dict[str, KernelArgument]:
         return {arg.name: arg for arg in self.args}
 
+    @cached_property
+    def has_complex_dtypes(self) -> bool:
+        """Whether any of the arguments or temporary variables has a complex
+        data type.
+        """
+        from itertools import chain
+        return any(
+                var.dtype.involves_complex()
+                for var in chain(self.args, self.temporary_variables.values()))
+
     @cached_property
     def scalar_loop_args(self):
         if self.args is None:
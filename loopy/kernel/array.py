@@ -587,6 +587,10 @@ def _pymbolic_parse_if_necessary(x):
 
 
 def _parse_shape_or_strides(x):
+    if isinstance(x, tuple) and not any(isinstance(xi, str) for xi in x):
+        # Nothing to parse, e.g. a shape made of integers.
+        return x
+
     import loopy as lp
     if x == "auto":
         warn("use of 'auto' as a shape or stride won't work "
@@ -25,22 +25,29 @@ THE SOFTWARE.
 
 
 from typing import (Type, Union, FrozenSet, Tuple, Optional, Sequence, Any, ClassVar,
-        cast)
+        Mapping, Set, cast)
+from numbers import Number
+import re
 from sys import intern
 from dataclasses import dataclass, replace
+from functools import cached_property
+from math import prod
 from enum import IntEnum
 from warnings import warn
 
 from immutables import Map
-import numpy as np  # noqa
-from pytools import ImmutableRecord
+import numpy as np
+from pytools import ImmutableRecord, memoize, memoize_method
 from pytools.tag import Taggable
 from pytools.tag import UniqueTag as UniqueTagBase, Tag
+from pymbolic.primitives import Expression
 
-from loopy.kernel.array import ArrayBase, ArrayDimImplementationTag
+from loopy.kernel.array import (ArrayBase, ArrayDimImplementationTag,
+        FixedStrideArrayDimTag)
 from loopy.diagnostic import LoopyError
+from loopy.symbolic import UncachedWalkMapper
 from loopy.typing import ExpressionT, ShapeType
-from loopy.types import LoopyType, auto
+from loopy.types import LoopyType, NumpyType, auto, to_loopy_type
 from loopy.kernel.instruction import (  # noqa
         InstructionBase,
         MemoryOrdering,
@@ -83,36 +90,62 @@ __doc__ = """
 
 # {{{ utilities
 
-def _names_from_expr(expr: Union[None, ExpressionT, str]) -> FrozenSet[str]:
-    from numbers import Number
-    from loopy.symbolic import DependencyMapper
-    dep_mapper = DependencyMapper()
+class _NameCollector(UncachedWalkMapper):
+    """Collects the names of the variables occurring in an expression, without
+    building the intermediate set of :class:`~pymbolic.primitives.Variable`
+    nodes that :class:`~loopy.symbolic.DependencyMapper` would.
+    """
+
+    def __init__(self, names: Set[str]):
+        self.names = names
+
+    def map_variable(self, expr, *args, **kwargs):
+        self.names.add(expr.name)
+
+    map_tagged_variable = map_variable
+
+    def map_call(self, expr, *args, **kwargs):
+        # The function being called is not a dependency.
+        for par in expr.parameters:
+            self.rec(par, *args, **kwargs)
+
+    def map_call_with_kwargs(self, expr, *args, **kwargs):
+        self.map_call(expr, *args, **kwargs)
+        for par in expr.kw_parameters.values():
+            self.rec(par, *args, **kwargs)
+
+    def map_reduction(self, expr, *args, **kwargs):
+        # Reduction inames are bound within the reduction, so they are not
+        # dependencies.
+        inner_names: Set[str] = set()
+        type(self)(inner_names)(expr.expr, *args, **kwargs)
+        self.names.update(inner_names - set(expr.inames))
 
-    from pymbolic.primitives import Expression
+
+def _add_names_from_expr(
+        expr: Union[None, ExpressionT, str], names: Set[str]) -> None:
     if isinstance(expr, str):
-        return frozenset({expr})
+        names.add(expr)
+    elif expr is None or isinstance(expr, Number):
+        pass
     elif isinstance(expr, Expression):
-        return frozenset(v.name for v in dep_mapper(expr))
-    elif expr is None:
-        return frozenset()
-    elif isinstance(expr, Number):
-        return frozenset()
+        _NameCollector(names)(expr)
     else:
         raise ValueError(f"unexpected value of expression-like object: '{expr}'")
 
 
-def _names_from_dim_tags(
+def _names_from_offset_and_dim_tags(
+        offset: Union[None, ExpressionT, str],
         dim_tags: Optional[Sequence[ArrayDimImplementationTag]]) -> FrozenSet[str]:
-    from loopy.kernel.array import FixedStrideArrayDimTag
-    if dim_tags is not None:
-        return frozenset({
-            name
-            for dim_tag in dim_tags
-            if isinstance(dim_tag, FixedStrideArrayDimTag)
-            for name in _names_from_expr(dim_tag.stride)
-            })
-    else:
-        return frozenset()
+    names: Set[str] = set()
+    _add_names_from_expr(offset, names)
+
+    if dim_tags:
+        for dim_tag in dim_tags:
+            if isinstance(dim_tag, FixedStrideArrayDimTag):
+                _add_names_from_expr(dim_tag.stride, names)
+
+    return frozenset(names)
 
 # }}}
 
@@ -130,18 +163,21 @@ def filter_iname_tags_by_type(tags, tag_type, max_num=None, min_num=None):
     :arg min_num: the minimum number of tags expected to be found.
     """
 
-    result = {tag for tag in tags if isinstance(tag, tag_type)}
-
     def strify_tag_type():
         if isinstance(tag_type, tuple):
             return ", ".join(t.__name__ for t in tag_type)
         else:
             return tag_type.__name__
 
-    if max_num is not None:
-        if len(result) > max_num:
-            raise LoopyError("cannot have more than {} tags "
-                    "of type(s): {}".format(max_num, strify_tag_type()))
+    result = set()
+    for tag in tags:
+        if isinstance(tag, tag_type):
+            result.add(tag)
+            # Stop scanning as soon as the limit is known to be exceeded.
+            if max_num is not None and len(result) > max_num:
+                raise LoopyError("cannot have more than {} tags "
+                        "of type(s): {}".format(max_num, strify_tag_type()))
+
     if min_num is not None:
         if len(result) < min_num:
             raise LoopyError("must have more than {} tags "
@@ -149,14 +185,48 @@ def filter_iname_tags_by_type(tags, tag_type, max_num=None, min_num=None):
     return result
 
 
+def _get_tag_sort_key(tag: Any) -> Optional[str]:
+    if isinstance(tag, InameImplementationTag):
+        return tag._sort_key
+    elif isinstance(tag, Tag):
+        return repr(tag)
+    else:
+        return None
+
+
 class InameImplementationTag(ImmutableRecord, UniqueTagBase):
     __slots__: ClassVar[Tuple[str, ...]] = ()
 
+    _type_key: ClassVar[str] = "InameImplementationTag"
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._type_key = intern(cls.__name__)
+
     def __hash__(self):
         return hash(self.key)
 
+    # Tags are ordered by the repr of their key, as keys of different tag
+    # types may not be mutually comparable (and hashes of strings vary
+    # between runs). Tags not from loopy are ordered by their own repr.
+
     def __lt__(self, other):
-        return self.__hash__() < other.__hash__()
+        other_sort_key = _get_tag_sort_key(other)
+        if other_sort_key is None:
+            return NotImplemented
+
+        return self._sort_key < other_sort_key
+
+    def __gt__(self, other):
+        other_sort_key = _get_tag_sort_key(other)
+        if other_sort_key is None:
+            return NotImplemented
+
+        return self._sort_key > other_sort_key
+
+    @cached_property
+    def _sort_key(self) -> str:
+        return repr(self.key)
 
     def update_persistent_hash(self, key_hash, key_builder):
         """Custom hash computation function for use with
@@ -172,7 +242,7 @@ class InameImplementationTag(ImmutableRecord, UniqueTagBase):
 
         Also used for persistent hash construction.
         """
-        return type(self).__name__
+        return self._type_key
 
 
 class ConcurrentTag(InameImplementationTag):
@@ -194,9 +264,9 @@ class AxisTag(UniqueInameTag):
         ImmutableRecord.__init__(self,
                 axis=axis)
 
-    @property
+    @cached_property
     def key(self):
-        return (type(self).__name__, self.axis)
+        return (self._type_key, self.axis)
 
     def __str__(self):
         return "%s.%d" % (
@@ -218,7 +288,7 @@ class LocalInameTag(LocalInameTagBase, AxisTag):
 class AutoLocalInameTagBase(LocalInameTagBase):
     @property
     def key(self):
-        return type(self).__name__
+        return self._type_key
 
 
 class AutoFitLocalInameTag(AutoLocalInameTagBase):
@@ -261,9 +331,9 @@ class UnrollHintTag(InameImplementationTag):
         ImmutableRecord.__init__(self,
                 value=value)
 
-    @property
+    @cached_property
     def key(self):
-        return (type(self).__name__, self.value)
+        return (self._type_key, self.value)
 
     def __str__(self):
         if self.value:
@@ -284,6 +354,30 @@ class InOrderSequentialSequentialTag(InameImplementationTag):
 
 ToInameTagConvertible = Union[str, None, Tag]
 
+# Tags are immutable, so instances may be shared between inames.
+_TAG_NAME_TO_TAG: Mapping[str, InameImplementationTag] = {
+        "ord": InOrderSequentialSequentialTag(),
+        "unr": UnrollTag(),
+        "vec": VectorizeTag(),
+        "ilp": UnrolledIlpTag(),
+        "ilp.unr": UnrolledIlpTag(),
+        "ilp.seq": LoopedIlpTag(),
+        "unr_hint": UnrollHintTag(),
+        "l.auto": AutoFitLocalInameTag(),
+        }
+
+_PARAMETRIZED_TAG_RE = re.compile(r"(g|l|unr_hint)\.(.*)", re.DOTALL)
+_PARAMETRIZED_TAG_PREFIX_TO_CLASS: Mapping[str, Type[InameImplementationTag]] = {
+        "g": GroupInameTag,
+        "l": LocalInameTag,
+        "unr_hint": UnrollHintTag,
+        }
+
+
+@memoize
+def _make_parametrized_tag(prefix: str, value: int) -> InameImplementationTag:
+    return _PARAMETRIZED_TAG_PREFIX_TO_CLASS[prefix](value)
+
 
 def parse_tag(tag: ToInameTagConvertible) -> Optional[Tag]:
     if tag is None:
@@ -297,29 +391,15 @@ def parse_tag(tag: ToInameTagConvertible) -> Optional[Tag]:
 
     if tag == "for":
         return None
-    elif tag == "ord":
-        return InOrderSequentialSequentialTag()
-    elif tag in ["unr"]:
-        return UnrollTag()
-    elif tag in ["vec"]:
-        return VectorizeTag()
-    elif tag in ["ilp", "ilp.unr"]:
-        return UnrolledIlpTag()
-    elif tag == "ilp.seq":
-        return LoopedIlpTag()
-    elif tag == "unr_hint":
-        return UnrollHintTag()
-    elif tag.startswith("unr_hint."):
-        offset = len("unr_hint.")
-        return UnrollHintTag(int(tag[offset:]))
-    elif tag.startswith("g."):
-        return GroupInameTag(int(tag[2:]))
-    elif tag.startswith("l."):
-        axis = tag[2:]
-        if axis == "auto":
-            return AutoFitLocalInameTag()
-        else:
-            return LocalInameTag(int(axis))
+
+    parsed_tag = _TAG_NAME_TO_TAG.get(tag)
+    if parsed_tag is not None:
+        return parsed_tag
+
+    match = _PARAMETRIZED_TAG_RE.fullmatch(tag)
+    if match is not None:
+        prefix, value = match.groups()
+        return _make_parametrized_tag(prefix, int(value))
     else:
         raise ValueError("cannot parse tag: %s" % tag)
 
@@ -361,6 +441,9 @@ class AddressSpace(IntEnum):
 
 # {{{ arguments
 
+_SHALLOW_COPY_ARG_FIELDS = frozenset({"tags", "is_input", "is_output"})
+
+
 class KernelArgument(ImmutableRecord):
     """Base class for all argument types.
 
@@ -389,12 +472,10 @@ class KernelArgument(ImmutableRecord):
 
         for_atomic = kwargs.pop("for_atomic", False)
 
-        from loopy.types import to_loopy_type
         dtype = to_loopy_type(
                 dtype, allow_auto=True, allow_none=True, for_atomic=for_atomic)
 
-        import loopy as lp
-        if dtype is lp.auto:
+        if dtype is auto:
             raise TypeError("dtype may not be lp.auto")
 
         kwargs["dtype"] = dtype
@@ -403,6 +484,19 @@ class KernelArgument(ImmutableRecord):
 
         ImmutableRecord.__init__(self, **kwargs)
 
+    def copy(self, **kwargs):
+        fields = type(self).fields
+        if (kwargs.keys() <= _SHALLOW_COPY_ARG_FIELDS
+                and kwargs.keys() <= fields
+                and kwargs.get("tags", frozenset()) is not None):
+            # None of these fields needs normalization by the constructor,
+            # so bypass it.
+            result = type(self).__new__(type(self))
+            result.__setstate__(self.get_copy_kwargs(**kwargs))
+            return result
+
+        return super().copy(**kwargs)
+
     def supporting_names(self) -> FrozenSet[str]:
         """'Supporting' names are those that are likely to be required to be
         present for any use of the argument.
@@ -498,13 +592,11 @@ class ArrayArg(ArrayBase, KernelArgument):
         key_builder.rec(key_hash, self.is_input)
         key_builder.rec(key_hash, self._separation_info)
 
+    @memoize_method
     def supporting_names(self) -> FrozenSet[str]:
         # Do not consider separation info here: The subarrays don't support, they
         # replace this array.
-        return (
-                _names_from_expr(self.offset)
-                | _names_from_dim_tags(self.dim_tags)
-                )
+        return _names_from_offset_and_dim_tags(self.offset, self.dim_tags)
 
 
 # Making this a function prevents incorrect use in isinstance.
@@ -561,11 +653,9 @@ class ImageArg(ArrayBase, KernelArgument):
         return ast_builder.get_image_arg_decl(self.name + name_suffix, shape,
                 self.num_target_axes(), dtype, is_written)
 
+    @memoize_method
     def supporting_names(self) -> FrozenSet[str]:
-        return (
-                _names_from_expr(self.offset)
-                | _names_from_dim_tags(self.dim_tags)
-                )
+        return _names_from_offset_and_dim_tags(self.offset, self.dim_tags)
 
 
 """
@@ -598,8 +688,7 @@ class ValueArg(KernelArgument, Taggable):
                 tags=tags)
 
     def __str__(self):
-        import loopy as lp
-        assert self.dtype is not lp.auto
+        assert self.dtype is not auto
 
         if self.dtype is None:
             type_str = "<auto/runtime>"
@@ -715,7 +804,6 @@ class TemporaryVariable(ArrayBase):
                         "offset must be 0 if initializer specified"
                         % name)
 
-            from loopy.types import NumpyType, to_loopy_type
             if dtype is auto or dtype is None:
                 dtype = NumpyType(initializer.dtype)
             elif to_loopy_type(dtype) != to_loopy_type(initializer.dtype):
@@ -787,14 +875,13 @@ class TemporaryVariable(ArrayBase):
 
         return super().copy(**kwargs)
 
-    @property
+    @cached_property
     def nbytes(self):
         shape = self.shape
         if self.storage_shape is not None:
             shape = self.storage_shape
 
-        from pytools import product
-        return product(si for si in shape)*self.dtype.itemsize
+        return prod(shape)*self.dtype.itemsize
 
     def __str__(self):
         if self.address_space is auto:
@@ -812,18 +899,22 @@ class TemporaryVariable(ArrayBase):
                 + f" aspace: {aspace_str}{bs_str}")
 
     def __eq__(self, other):
+        if self is other:
+            return True
+
+        # Compare the initializers last, as that may be expensive.
         return (
                 super().__eq__(other)
                 and self.storage_shape == other.storage_shape
                 and self.base_indices == other.base_indices
                 and self.address_space == other.address_space
                 and self.base_storage == other.base_storage
-                and (
-                    (self.initializer is None and other.initializer is None)
-                    or np.array_equal(self.initializer, other.initializer))
                 and self.read_only == other.read_only
                 and (self._base_storage_access_may_be_aliasing
                     == other._base_storage_access_may_be_aliasing)
+                and (
+                    self.initializer is other.initializer
+                    or np.array_equal(self.initializer, other.initializer))
                 )
 
     def update_persistent_hash(self, key_hash, key_builder):
@@ -840,16 +931,19 @@ class TemporaryVariable(ArrayBase):
 
         initializer = self.initializer
         if initializer is not None:
-            initializer = (initializer.tolist(), initializer.dtype)
+            # tobytes() is a single copy, whereas tolist() creates a Python
+            # object per entry.
+            initializer = (
+                    initializer.tobytes(), initializer.dtype, initializer.shape)
         key_builder.rec(key_hash, initializer)
 
         key_builder.rec(key_hash, self.read_only)
         key_builder.rec(key_hash, self._base_storage_access_may_be_aliasing)
 
+    @memoize_method
     def supporting_names(self) -> FrozenSet[str]:
         return (
-                _names_from_expr(self.offset)
-                | _names_from_dim_tags(self.dim_tags)
+                _names_from_offset_and_dim_tags(self.offset, self.dim_tags)
                 | (
                     frozenset({self.base_storage})
                     if self.base_storage else frozenset())
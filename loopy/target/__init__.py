@@ -49,6 +49,8 @@ THE SOFTWARE.
 from typing import (Any, Tuple, Generic, TypeVar, Sequence, ClassVar, Optional,
         TYPE_CHECKING)
 
+from loopy.tools import LoopyKeyBuilder
+
 if TYPE_CHECKING:
     from loopy.typing import ExpressionT
     from loopy.codegen import CodeGenerationState
@@ -59,6 +61,9 @@ if TYPE_CHECKING:
 
 ASTType = TypeVar("ASTType")
 
+# The key builder holds no state, so a single instance can be shared.
+_KEY_BUILDER = LoopyKeyBuilder()
+
 
 class TargetBase:
     """Base class for all targets, i.e. different combinations of code that
@@ -72,25 +77,43 @@ class TargetBase:
     hash_fields: ClassVar[Tuple[str, ...]] = ()
     comparison_fields: ClassVar[Tuple[str, ...]] = ()
 
+    _type_name_bytes: ClassVar[bytes] = b"TargetBase"
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._type_name_bytes = cls.__name__.encode()
+
     def __hash__(self):
-        # NOTE: _hash_value may vanish during pickling
+        # NOTE: _hash_value is not pickled, see __getstate__
         if getattr(self, "_hash_value", None) is None:
-            from loopy.tools import LoopyKeyBuilder
-            key_hash = LoopyKeyBuilder.new_hash()
-            LoopyKeyBuilder()(self)
+            key_hash = _KEY_BUILDER.new_hash()
+            _KEY_BUILDER.rec(key_hash, self)
             object.__setattr__(self, "_hash_value", hash(key_hash.digest()))
 
         return self._hash_value  # pylint: disable=no-member
 
     def update_persistent_hash(self, key_hash, key_builder):
-        key_hash.update(type(self).__name__.encode())
+        key_hash.update(self._type_name_bytes)
         for field_name in self.hash_fields:
             key_builder.rec(key_hash, getattr(self, field_name))
 
+    def __getstate__(self):
+        # The cached hash depends on the process's string hash seed, so it
+        # must not travel with pickles.
+        state = self.__dict__.copy()
+        state.pop("_hash_value", None)
+        return state
+
     def __eq__(self, other):
         if type(self) is not type(other):
             return False
 
+        self_hash = getattr(self, "_hash_value", None)
+        other_hash = getattr(other, "_hash_value", None)
+        if (self_hash is not None and other_hash is not None
+                and self_hash != other_hash):
+            return False
+
         for field_name in self.comparison_fields:
             if getattr(self, field_name) != getattr(other, field_name):
                 return False
@@ -299,15 +322,26 @@ class ASTBuilderBase(Generic[ASTType]):
 # {{{ dummy host ast builder
 
 class _DummyExpressionToCodeMapper:
+    __slots__ = ()
+
     def rec(self, expr, prec, type_context=None, needed_dtype=None):
         return ""
 
     __call__ = rec
 
 
+# The mapper is stateless, so one instance serves all builders.
+_DUMMY_EXPRESSION_TO_CODE_MAPPER = _DummyExpressionToCodeMapper()
+
+
 class _DummyASTBlock:
+    __slots__ = ()
+
+    # Dummy blocks never hold anything, so all of them can share this.
+    contents: ClassVar[Tuple[Any, ...]] = ()
+
     def __init__(self, arg):
-        self.contents = []
+        pass
 
     def __str__(self):
         return ""
@@ -322,13 +356,13 @@ class DummyHostASTBuilder(ASTBuilderBase[None]):
             self, codegen_state, codegen_result,
             schedule_index,
             ) -> Tuple[Sequence[Tuple[str, str]], None]:
-        return [], None
+        return (), None
 
     def get_temporary_decls(self, codegen_state, schedule_index):
         return []
 
     def get_expression_to_code_mapper(self, codegen_state):
-        return _DummyExpressionToCodeMapper()
+        return _DUMMY_EXPRESSION_TO_CODE_MAPPER
 
     def get_kernel_call(self, codegen_state, name, gsize, lsize):
         return None
@@ -214,16 +214,6 @@ def to_loopy_type(dtype: ToLoopyTypeConvertible,
         else:
             raise LoopyError("dtype may not be auto")
 
-    numpy_dtype = None
-
-    if dtype is not None:
-        try:
-            # We're playing fast and loose here, and mypy is onto us. It has a
-            # point.
-            numpy_dtype = np.dtype(dtype)  # type: ignore
-        except Exception:
-            pass
-
     if isinstance(dtype, LoopyType):
         if for_atomic:
             if isinstance(dtype, NumpyType):
@@ -234,7 +224,12 @@ def to_loopy_type(dtype: ToLoopyTypeConvertible,
 
         return dtype
 
-    elif numpy_dtype is not None:
+    try:
+        numpy_dtype = np.dtype(dtype)
+    except Exception:
+        numpy_dtype = None
+
+    if numpy_dtype is not None:
         if for_atomic:
             return AtomicNumpyType(numpy_dtype)
         else:
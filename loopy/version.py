@@ -44,7 +44,7 @@ else:
 
 VERSION = (2024, 1)
 VERSION_STATUS = ""
-VERSION_TEXT = ".".join(str(x) for x in VERSION) + VERSION_STATUS
+VERSION_TEXT = ".".join(map(str, VERSION)) + VERSION_STATUS
 
 try:
     import islpy.version
@@ -69,9 +69,9 @@ MOST_RECENT_LANGUAGE_VERSION = (2018, 2)
 
 LOOPY_USE_LANGUAGE_VERSION_2018_2 = (2018, 2)
 
-LANGUAGE_VERSION_SYMBOLS = [
+LANGUAGE_VERSION_SYMBOLS = (
         "LOOPY_USE_LANGUAGE_VERSION_2018_2",
-        ]
+        )
 
 __doc__ = """
 
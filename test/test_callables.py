@@ -1514,6 +1514,50 @@ def test_inline_constant_access():
     lp.generate_code_v2(knl).device_code()
 
 
+def test_parallel_codegen_matches_serial(monkeypatch):
+    from loopy.diagnostic import LoopyError
+
+    callee1 = lp.make_function(
+            "{[i]: 0<=i<4}",
+            """
+            b[i] = 2*a[i]
+            """, name="twice")
+    callee2 = lp.make_function(
+            "{[i]: 0<=i<4}",
+            """
+            b[i] = 3*a[i]
+            """, name="thrice")
+    caller = lp.make_kernel(
+            "{[i]: 0<=i<4}",
+            """
+            [i]: y[i] = twice([i]: x[i])
+            [i]: z[i] = thrice([i]: y[i])
+            """,
+            [lp.GlobalArg("x, y, z", np.float64, shape=(4,))])
+    t_unit = lp.merge([callee1, callee2, caller])
+
+    import loopy.codegen
+    monkeypatch.setattr(loopy.codegen, "_MIN_KERNELS_FOR_PARALLEL_CODEGEN", 2)
+
+    with lp.CacheMode(False):
+        monkeypatch.setenv("LOOPY_CODEGEN_JOBS", "1")
+        serial_code = lp.generate_code_v2(t_unit).device_code()
+
+        monkeypatch.setenv("LOOPY_CODEGEN_JOBS", "2")
+        parallel_code = lp.generate_code_v2(t_unit).device_code()
+
+        assert parallel_code == serial_code
+
+        for value in ["abc", "0", "-1"]:
+            monkeypatch.setenv("LOOPY_CODEGEN_JOBS", value)
+            with pytest.raises(LoopyError, match="LOOPY_CODEGEN_JOBS"):
+                lp.generate_code_v2(t_unit)
+
+        # only read for translation units with enough kernels
+        lp.generate_code_v2(lp.make_kernel(
+            "{[i]: 0<=i<4}", "out[i] = 2*i"))
+
+
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         exec(sys.argv[1])
@@ -3668,6 +3668,74 @@ def test_no_unnecessary_lbarrier(ctx_factory):
     assert not barrier_between(knl, "write_s_a", "write_ao")
 
 
+def test_code_gen_result_reused_for_same_t_unit():
+    t_unit = lp.make_kernel(
+        "{[i]: 0 <= i < 10}",
+        "out[i] = 2*a[i]")
+    t_unit = lp.add_dtypes(t_unit, {"a": np.float64})
+
+    with lp.CacheMode(True):
+        cgr = lp.generate_code_v2(t_unit)
+        assert lp.generate_code_v2(t_unit) is cgr
+
+    # the remembered result is tied to the object, not carried to copies
+    from loopy.codegen import _get_remembered_code_gen_result
+    assert _get_remembered_code_gen_result(t_unit) is cgr
+    assert _get_remembered_code_gen_result(t_unit.copy()) is None
+
+    from pickle import dumps, loads
+    assert _get_remembered_code_gen_result(loads(dumps(t_unit))) is None
+
+
+def test_codegen_cachemanager_with_kernel():
+    from loopy.codegen.tools import CodegenOperationCacheManager
+
+    t_unit = lp.make_kernel(
+        "{[i]: 0 <= i < 10}",
+        "out[i] = 2*a[i]")
+    t_unit = lp.add_dtypes(t_unit, {"a": np.float64})
+    t_unit = lp.preprocess_kernel(t_unit)
+    knl = lp.get_one_linearized_kernel(t_unit.default_entrypoint,
+                                       t_unit.callables_table)
+
+    cachemanager = CodegenOperationCacheManager.from_kernel(knl)
+    assert cachemanager.with_kernel(knl) is cachemanager
+    assert cachemanager.with_kernel(knl.copy(name="other")) is cachemanager
+
+    new_knl = lp.tag_inames(knl, {"i": "unr"})
+    assert cachemanager.with_kernel(new_knl) is not cachemanager
+
+
+def test_sort_mixed_iname_tags():
+    from dataclasses import dataclass
+    from pytools.tag import Tag
+    from loopy.kernel.data import (AutoFitLocalInameTag, GroupInameTag,
+            LocalInameTag, UnrollHintTag, UnrollTag)
+
+    @dataclass(frozen=True)
+    class MyTag(Tag):
+        pass
+
+    iname_tags = [LocalInameTag(1), GroupInameTag(0), UnrollTag(),
+            AutoFitLocalInameTag(), UnrollHintTag(), UnrollHintTag(2)]
+
+    # keys of differing shapes (str, tuples, None values) must be orderable
+    assert sorted(iname_tags) == sorted(reversed(iname_tags))
+
+    # tags not from loopy (without an order of their own) are ordered by
+    # their repr, from either side of the comparison
+    my_tag = MyTag()
+    assert (LocalInameTag(0) < my_tag) == (repr(LocalInameTag(0).key)
+                                           < repr(my_tag))
+    assert (my_tag < LocalInameTag(0)) == (LocalInameTag(0) > my_tag)
+    tags = [*iname_tags, my_tag]
+    assert sorted(tags) == sorted(reversed(tags))
+
+    assert LocalInameTag(0).__lt__(object()) is NotImplemented
+    with pytest.raises(TypeError):
+        sorted([LocalInameTag(0), object()])
+
+
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         exec(sys.argv[1])
@@ -24,6 +24,7 @@ from pickle import loads, dumps
 
 import pytest
 import loopy as lp
+from pytools.tag import Tag
 
 import sys
 
@@ -340,6 +341,70 @@ def test_memoize_on_disk_with_pym_expr():
     assert cached_result == uncached_result
 
 
+def test_names_from_offset_and_dim_tags():
+    import pymbolic.primitives as prim
+    from loopy.kernel.array import FixedStrideArrayDimTag
+    from loopy.kernel.data import _names_from_offset_and_dim_tags
+
+    a, i, n = prim.Variable("a"), prim.Variable("i"), prim.Variable("n")
+
+    def names(offset, strides=()):
+        return _names_from_offset_and_dim_tags(
+                offset, tuple(FixedStrideArrayDimTag(s) for s in strides))
+
+    assert names(n) == {"n"}
+    assert names(a[i + n]) == {"a", "i", "n"}
+    # the called function is not a dependency
+    assert names(prim.Variable("f")(n)) == {"n"}
+    assert names(prim.CallWithKwargs(prim.Variable("f"), (n,), {"k": i})) == {
+            "n", "i"}
+
+    from loopy.symbolic import Reduction
+    j = prim.Variable("j")
+    assert names(Reduction("sum", ("j",), j*n)) == {"n"}
+    assert names(j + Reduction("sum", ("j",), j*n)) == {"j", "n"}
+    assert names("off", [2*n, 1]) == {"off", "n"}
+    assert names(None) == frozenset()
+    assert names(3, [n]) == {"n"}
+    assert _names_from_offset_and_dim_tags(None, None) == frozenset()
+
+
+class _CopyTestTag(Tag):
+    pass
+
+
+def test_kernel_argument_shallow_copy():
+    from pytools import ImmutableRecord
+
+    args = [
+        lp.GlobalArg("a", "float64", shape=(10, "n"), offset="off"),
+        lp.ValueArg("n", "int32"),
+        lp.ConstantArg("c", "float32", shape=(4,)),
+        ]
+
+    for arg in args:
+        kwargs_list = [{"tags": frozenset({_CopyTestTag()})}]
+        if not isinstance(arg, lp.ConstantArg):
+            kwargs_list.extend([{"is_input": False}, {"is_output": True}])
+
+        for kwargs in kwargs_list:
+            fast = arg.copy(**kwargs)
+            slow = ImmutableRecord.copy(arg, **kwargs)
+
+            assert type(fast) is type(arg)
+            assert fast == slow
+            assert hash(fast) == hash(slow)
+            assert all(getattr(fast, k) == v for k, v in kwargs.items())
+            assert loads(dumps(fast)) == slow
+
+    # other fields go through the constructor, which normalizes them
+    from pymbolic import var
+    assert args[0].copy(shape=(5, "n")).shape == (5, var("n"))
+    for kwargs in [{"is_input": False}, {"is_output": True}]:
+        with pytest.raises(TypeError):
+            args[2].copy(**kwargs)
+
+
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         exec(sys.argv[1])
@@ -805,6 +805,28 @@ def test_ispc_private_var():
     print(cg_result.device_code())
 
 
+def test_target_hash():
+    assert hash(lp.CTarget()) == hash(lp.CTarget())
+    assert hash(lp.CTarget()) != hash(lp.OpenCLTarget())
+    assert hash(lp.CudaTarget()) != hash(lp.ISPCTarget())
+
+    # the cached hash is not pickled
+    from pickle import dumps, loads
+    target = lp.CTarget()
+    hash(target)
+    assert "_hash_value" in target.__dict__
+    unpickled_target = loads(dumps(target))
+    assert "_hash_value" not in unpickled_target.__dict__
+    assert unpickled_target == target
+    assert hash(unpickled_target) == hash(target)
+
+    # targets with differing cached hashes compare unequal
+    fortran_abi_target = lp.CTarget(fortran_abi=True)
+    assert hash(fortran_abi_target) != hash(target)
+    assert fortran_abi_target != target
+    assert target != fortran_abi_target
+
+
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         exec(sys.argv[1])